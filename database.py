@@ -1,9 +1,14 @@
 import enum
+import statistics
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 
 import httpx
-from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Integer, String, Text, create_engine, text
+from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Integer, String, Text, create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 try:
     from astrbot.api import logger
@@ -16,32 +21,88 @@ Base = declarative_base()
 # Global offset (in seconds) between system time and network time
 _time_offset = 0
 
+TIME_SYNC_URL = "http://www.baidu.com"
+TIME_SYNC_SAMPLES = 5
+# Fewer samples than this leaves nothing meaningful to trim, so the offset is left alone
+TIME_SYNC_MIN_SAMPLES = 3
+# Market.__init__ syncs during plugin load; cap the total wait there at one request's timeout
+TIME_SYNC_BUDGET = 3.0
+# Date headers have 1s resolution, so smaller corrections are just noise
+TIME_SYNC_MIN_CHANGE = 2.0
+
+# Shared client so repeated samples and periodic re-syncs reuse one pooled connection;
+# created on first use and released by close_time_client() on plugin unload
+_time_client = None
+_time_client_lock = threading.Lock()
+
+def _get_time_client():
+    global _time_client
+    with _time_client_lock:
+        if _time_client is None:
+            _time_client = httpx.Client(timeout=3, transport=httpx.HTTPTransport(retries=0))
+        return _time_client
+
+def close_time_client():
+    global _time_client
+    with _time_client_lock:
+        if _time_client is not None:
+            _time_client.close()
+            _time_client = None
+
+def _sample_time_offset(timeout):
+    """One RTT-corrected offset sample from the Date header, or None"""
+    sent = datetime.now(timezone.utc)
+    resp = _get_time_client().head(TIME_SYNC_URL, timeout=timeout)
+    received = datetime.now(timezone.utc)
+    date_str = resp.headers.get('Date')
+    if not date_str:
+        return None
+    network_time = datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S GMT')
+    network_time = network_time.replace(tzinfo=timezone.utc)
+    # The server stamped the response roughly halfway through the round trip
+    midpoint = sent + (received - sent) / 2
+    return (network_time - midpoint).total_seconds()
+
 def sync_network_time():
     global _time_offset
-    try:
-        resp = httpx.head("http://www.baidu.com", timeout=3)
-        date_str = resp.headers.get('Date')
-        if date_str:
-            network_time = datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S GMT')
-            network_time = network_time.replace(tzinfo=timezone.utc)
-            
-            system_time = datetime.now(timezone.utc)
-            
-            _time_offset = (network_time - system_time).total_seconds()
-            logger.info(f"[Zirunbi] Time synced. Offset: {_time_offset:.2f}s")
-        else:
-            logger.warning("[Zirunbi] Failed to get Date header")
-    except Exception as e:
-        logger.warning(f"[Zirunbi] Time sync failed: {e}")
+    samples = []
+    deadline = time.monotonic() + TIME_SYNC_BUDGET
+    for _ in range(TIME_SYNC_SAMPLES):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # One failed request shouldn't cost the remaining samples
+        try:
+            offset = _sample_time_offset(remaining)
+        except Exception as e:
+            logger.warning(f"[Zirunbi] Time sync request failed: {e}")
+            continue
+        if offset is not None:
+            samples.append(offset)
+
+    if len(samples) < TIME_SYNC_MIN_SAMPLES:
+        logger.warning(
+            f"[Zirunbi] Time sync skipped: only {len(samples)} of {TIME_SYNC_MIN_SAMPLES} required samples"
+        )
+        return
+
+    # Drop the extremes so one jittery response cannot skew the result
+    samples.sort()
+    samples = samples[1:-1]
+    new_offset = statistics.median(samples)
+
+    if abs(new_offset - _time_offset) > TIME_SYNC_MIN_CHANGE:
+        _time_offset = new_offset
+        logger.info(f"[Zirunbi] Time synced. Offset: {_time_offset:.2f}s")
+    else:
+        logger.debug(f"[Zirunbi] Time offset stable: {new_offset:.2f}s (current {_time_offset:.2f}s)")
+
+CHINA_TZ = timezone(timedelta(hours=8))
 
 # China Timezone helper with offset
 def get_china_time():
-    utc_now = datetime.now(timezone.utc)
-    # Apply offset
-    utc_now = utc_now + timedelta(seconds=_time_offset)
-    
-    cn_tz = timezone(timedelta(hours=8))
-    return utc_now.astimezone(cn_tz)
+    # Build directly in UTC+8 and apply the network offset, skipping astimezone()
+    return datetime.now(CHINA_TZ) + timedelta(seconds=_time_offset)
 
 class OrderType(enum.Enum):
     BUY = "buy"
@@ -72,6 +133,7 @@ class MarketHistory(Base):
     __tablename__ = 'market_history'
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
+    # Default is for single ORM inserts; bulk_insert_history callers pass timestamps explicitly
     timestamp = Column(DateTime, default=get_china_time)
     open = Column(Float)
     high = Column(Float)
@@ -101,51 +163,59 @@ class DB:
     def __init__(self, db_path):
         if not db_path.startswith("sqlite"):
             db_path = f"sqlite:///{db_path}"
-        self.engine = create_engine(db_path)
+        self.db_path = db_path
+        # Market thread and web server share the engine, so allow cross-thread connections
+        self.engine = create_engine(
+            db_path,
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=5,
+        )
+        event.listen(self.engine, "connect", self._set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
         
         # Auto-migration for schema updates
         self._migrate()
     
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_conn, _conn_record):
+        # WAL lets web reads run while the market thread writes; NORMAL skips the per-commit fsync
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
     def _migrate(self):
-        with self.engine.connect() as conn:
-            def column_exists(table, column):
-                try:
-                    result = conn.execute(text(f"PRAGMA table_info({table})"))
-                    for row in result:
-                        if row[1] == column:
-                            return True
-                except Exception:
-                    pass
-                return False
-
-            # Check and add symbol to orders
-            if not column_exists('orders', 'symbol'):
+        # One transaction; each table's columns are read once and only missing ones are added
+        with self.engine.begin() as conn:
+            column_additions = [
+                ('orders', 'symbol', 'VARCHAR'),
+                ('market_history', 'symbol', 'VARCHAR'),
+                ('users', 'password_hash', 'VARCHAR'),
+            ]
+            existing_columns = {}
+            for table in {table for table, _, _ in column_additions}:
                 try:
-                    conn.execute(text("ALTER TABLE orders ADD COLUMN symbol VARCHAR"))
-                    conn.commit()
+                    existing_columns[table] = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
                 except Exception as e:
-                    logger.warning(f"Migration error (orders.symbol): {e}")
+                    logger.warning(f"Migration error (reading {table} columns): {e}")
+                    existing_columns[table] = set()
 
-            # Check and add symbol to market_history
-            if not column_exists('market_history', 'symbol'):
+            for table, column, col_type in column_additions:
+                if column in existing_columns[table]:
+                    continue
                 try:
-                    conn.execute(text("ALTER TABLE market_history ADD COLUMN symbol VARCHAR"))
-                    conn.commit()
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}"))
                 except Exception as e:
-                    logger.warning(f"Migration error (market_history.symbol): {e}")
-            
-            # Check and add password_hash to users
-            if not column_exists('users', 'password_hash'):
-                try:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN password_hash VARCHAR"))
-                    conn.commit()
-                except Exception as e:
-                    logger.warning(f"Migration error (users.password_hash): {e}")
+                    logger.warning(f"Migration error ({table}.{column}): {e}")
             
             # Create indexes for query performance (safe for both new and existing databases)
             index_definitions = [
-                ('ix_market_history_symbol_ts', 'market_history', 'symbol, timestamp'),
+                # Covers the kline column selects so SQLite never touches the table rows
+                ('ix_market_history_kline_cover', 'market_history', 'symbol, timestamp, open, high, low, close, volume'),
                 ('ix_orders_user_status', 'orders', 'user_id, status'),
                 ('ix_orders_user_created', 'orders', 'user_id, created_at'),
                 ('ix_user_holdings_user_symbol', 'user_holdings', 'user_id, symbol'),
@@ -157,20 +227,52 @@ class DB:
                 except Exception as e:
                     logger.warning(f"Index creation {idx_name}: {e}")
 
-            # Ensure transactions are committed
-            if conn.in_transaction():
-                conn.commit()
+            # Superseded by the covering index, which has the same (symbol, timestamp) prefix
+            try:
+                conn.execute(text("DROP INDEX IF EXISTS ix_market_history_symbol_ts"))
+            except Exception as e:
+                logger.warning(f"Index drop ix_market_history_symbol_ts: {e}")
 
         self.Session = sessionmaker(bind=self.engine)
     
     def get_session(self):
         return self.Session()
+
+    def bulk_insert_history(self, rows, chunk_size=1000):
+        """Insert MarketHistory row dicts in one transaction via executemany"""
+        if not rows:
+            return
+        # Stamp rows lacking a timestamp once, instead of the column default firing per row
+        if any("timestamp" not in row for row in rows):
+            now = get_china_time()
+            rows = [row if "timestamp" in row else {**row, "timestamp": now} for row in rows]
+        table = MarketHistory.__table__
+        with self.engine.begin() as conn:
+            for start in range(0, len(rows), chunk_size):
+                conn.execute(table.insert(), rows[start:start + chunk_size])
     
     def get_or_create_user(self, user_id):
         session = self.Session()
-        user = session.query(User).filter_by(user_id=str(user_id)).first()
+        user = session.get(User, str(user_id))
         if not user:
             user = User(user_id=str(user_id))
             session.add(user)
             session.commit()
         return user, session
+
+
+class AsyncDB:
+    """aiosqlite-backed engine for read-heavy web handlers; schema and migration stay with DB"""
+
+    def __init__(self, db_path):
+        if not db_path.startswith("sqlite"):
+            db_path = f"sqlite:///{db_path}"
+        self.engine = create_async_engine(db_path.replace("sqlite://", "sqlite+aiosqlite://", 1))
+        event.listen(self.engine.sync_engine, "connect", DB._set_sqlite_pragmas)
+        self.Session = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def get_session(self):
+        return self.Session()
+
+    async def dispose(self):
+        await self.engine.dispose()
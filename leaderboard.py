@@ -1,7 +1,14 @@
+import heapq
 import re
 from collections.abc import Iterable
 from typing import cast
 
+try:
+    # Linear-time matching for admin-supplied trigger patterns (optional: pip install google-re2)
+    import re2 as _trigger_re
+except ImportError:
+    _trigger_re = re
+
 NON_MATCHING_REGEX: re.Pattern[str] = re.compile(r"$.^")
 
 
@@ -20,8 +27,8 @@ def compile_trigger_regex(pattern: object = None) -> re.Pattern[str]:
         text = "" if pattern is None else str(pattern).strip()
         if not text:
             return NON_MATCHING_REGEX
-        return re.compile(text)
-    except re.error:
+        return _trigger_re.compile(text)
+    except _trigger_re.error:
         return NON_MATCHING_REGEX
 
 
@@ -66,9 +73,12 @@ def compute_leaderboard(
         by_user[uid]["holdings_value"] = holdings_value
         by_user[uid]["total"] = float(cast(float, by_user[uid]["balance"])) + holdings_value
 
-    entries = list(by_user.values())
-    entries.sort(key=lambda item: (-float(cast(float, item["total"])), str(item["user_id"])))
-    entries = entries[:limit]
+    # Only the top `limit` entries are needed, so a bounded heap beats a full sort
+    entries = heapq.nsmallest(
+        limit,
+        by_user.values(),
+        key=lambda item: (-float(cast(float, item["total"])), str(item["user_id"])),
+    )
 
     for entry in entries:
         missing = cast(set[str], entry["missing_symbols"])
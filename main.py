@@ -1,5 +1,8 @@
+import asyncio
+import functools
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from astrbot.api import logger
 from astrbot.api.all import *
@@ -17,6 +20,7 @@ try:
         OrderType,
         User,
         UserHolding,
+        close_time_client,
         get_china_time,
     )
     from .market import Market
@@ -24,12 +28,35 @@ try:
 except ImportError:
     import leaderboard
     import plotter
-    from database import DB, MarketHistory, MarketNews, Order, OrderStatus, OrderType, User, UserHolding, get_china_time
+    from database import (
+        DB,
+        MarketHistory,
+        MarketNews,
+        Order,
+        OrderStatus,
+        OrderType,
+        User,
+        UserHolding,
+        close_time_client,
+        get_china_time,
+    )
     from market import Market
     from web_server import WebServer, pwd_context
 
 from datetime import timedelta
 
+from sqlalchemy import select
+
+# Plain column rows for plotter.plot_kline (skips ORM instance construction)
+KLINE_COLUMNS = (
+    MarketHistory.timestamp,
+    MarketHistory.open,
+    MarketHistory.high,
+    MarketHistory.low,
+    MarketHistory.close,
+    MarketHistory.volume,
+)
+
 
 @register("zrb_trader", "LumineStory", "模拟炒股插件", "1.1.1", "https://github.com/oyxning/astrbot-plugin-zirunbi")
 class ZRBTrader(Star):
@@ -42,6 +69,8 @@ class ZRBTrader(Star):
         # Init plotter font
         font_path = config.get("font_path", "")
         plotter.init_font(font_path)
+        # pyplot is not thread-safe, so a single worker renders charts one at a time off the event loop
+        self._plot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zrb-plot")
 
         self.market = Market(self.db, config)
         self.market.start()
@@ -49,16 +78,25 @@ class ZRBTrader(Star):
 
         # Start Web Server
         web_port = config.get("web_port", 8000)
-        self.web_server = WebServer(self.db, self.market, port=web_port)
+        self.web_server = WebServer(
+            self.db, self.market, port=web_port, secret_key=config.get("web_secret_key", "")
+        )
         self.web_server.run_in_background()
         logger.info(f"[Zirunbi] Web server started on port {web_port}")
 
     async def terminate(self):
         self.market.stop()
+        close_time_client()
+        self._plot_executor.shutdown(wait=False)
         if hasattr(self, 'web_server'):
             await self.web_server.stop()
         logger.info("[Zirunbi] Plugin terminated")
 
+    async def _run_plot(self, plot_func, *args, **kwargs):
+        """Run a blocking plotter function in the plot worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._plot_executor, functools.partial(plot_func, *args, **kwargs))
+
     def _save_temp_image(self, buf):
         """Helper to save BytesIO to temp file for image_result"""
         try:
@@ -205,7 +243,7 @@ class ZRBTrader(Star):
                 yield event.plain_result("请输入币种，例如: /zrb kline ZRB [数量]")
                 return
             sym = args[2].upper()
-            if sym not in self.market.symbols:
+            if sym not in self.market.symbol_set:
                 yield event.plain_result(f"不支持的币种: {sym}")
                 return
 
@@ -222,13 +260,12 @@ class ZRBTrader(Star):
 
             session = self.db.get_session()
             try:
-                history = (
-                    session.query(MarketHistory)
+                history = session.execute(
+                    select(*KLINE_COLUMNS)
                     .filter_by(symbol=sym)
                     .order_by(MarketHistory.timestamp.desc())
                     .limit(kline_limit)
-                    .all()
-                )
+                ).all()
                 history = history[::-1]
             finally:
                 session.close()
@@ -238,7 +275,7 @@ class ZRBTrader(Star):
                 return
 
             title_suffix = " (Closed)" if not self.market.is_open else ""
-            img_buf = plotter.plot_kline(history, title=f"{sym} K-Line ({len(history)}){title_suffix}")
+            img_buf = await self._run_plot(plotter.plot_kline, history, title=f"{sym} K-Line ({len(history)}){title_suffix}")
             if img_buf:
                 img_path = self._save_temp_image(img_buf)
                 if img_path:
@@ -255,7 +292,7 @@ class ZRBTrader(Star):
                 return
 
             sym = args[2].upper()
-            if sym not in self.market.symbols:
+            if sym not in self.market.symbol_set:
                 yield event.plain_result(f"不支持的币种: {sym}")
                 return
 
@@ -271,12 +308,11 @@ class ZRBTrader(Star):
             now = get_china_time()
             start_date = now - timedelta(days=days)
 
-            history = (
-                session.query(MarketHistory)
-                .filter(MarketHistory.symbol == sym, MarketHistory.timestamp >= start_date)
+            history = session.execute(
+                select(*KLINE_COLUMNS)
+                .where(MarketHistory.symbol == sym, MarketHistory.timestamp >= start_date)
                 .order_by(MarketHistory.timestamp)
-                .all()
-            )
+            ).all()
             session.close()
 
             if not history:
@@ -287,7 +323,7 @@ class ZRBTrader(Star):
             # If > 500 points, maybe limit? 3 mins * 4 hours * days = 80 points/day. 3 days = 240. 30 days = 2400.
             # mpf can handle 2400 but might be crowded. Let's limit display logic if needed later.
 
-            img_buf = plotter.plot_kline(history, title=f"{sym} History ({days} Days)")
+            img_buf = await self._run_plot(plotter.plot_kline, history, title=f"{sym} History ({days} Days)")
             if img_buf:
                 img_path = self._save_temp_image(img_buf)
                 if img_path:
@@ -405,7 +441,7 @@ class ZRBTrader(Star):
                 if sym in coin_info:
                     yield event.plain_result(coin_info[sym])
                 else:
-                    if sym in self.market.symbols:
+                    if sym in self.market.symbol_set:
                         yield event.plain_result(f"【{sym}】\n暂无详细介绍。\n(虚拟资产，仅供娱乐)")
                     else:
                         yield event.plain_result(f"未知币种: {sym}")
@@ -491,7 +527,7 @@ class ZRBTrader(Star):
                 return
 
             symbol = args[2].upper()
-            if symbol not in self.market.symbols:
+            if symbol not in self.market.symbol_set:
                 yield event.plain_result(f"不支持的币种: {symbol}")
                 return
 
@@ -532,13 +568,16 @@ class ZRBTrader(Star):
             session.close()
 
             # Trigger immediate match
-            self.market.match_single_order(order_id)
-
-            # Check status
-            session = self.db.get_session()
-            updated_order = session.query(Order).get(order_id)
+            order_status = self.market.match_single_order(order_id)
+            if order_status is None:
+                # No longer pending (e.g. filled by the market loop meanwhile); read the stored status
+                session = self.db.get_session()
+                try:
+                    order_status = session.get(Order, order_id).status
+                finally:
+                    session.close()
 
-            if updated_order.status == OrderStatus.FILLED:
+            if order_status == OrderStatus.FILLED:
                 status_msg = "✅ 已成交"
                 desc = f"成交价格: {self.market.prices[symbol]:.2f}"
             else:
@@ -549,8 +588,6 @@ class ZRBTrader(Star):
                     status_msg = "⏱️ 已挂单"
                     desc = "订单已提交，等待市场价格到达指定价位。"
 
-            session.close()
-
             yield event.plain_result(
                 f"{cmd.upper()} 订单已提交。\n状态: {status_msg}\n说明: {desc}\n订单ID: {order_id}"
             )
@@ -579,7 +616,7 @@ class ZRBTrader(Star):
             session.close()
 
             # Plot
-            img_buf = plotter.plot_holdings_multi(user.balance, holdings_dict)
+            img_buf = await self._run_plot(plotter.plot_holdings_multi, user.balance, holdings_dict)
             img_path = self._save_temp_image(img_buf)
 
             if img_path:
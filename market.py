@@ -54,8 +54,9 @@ class Market:
         self.manual_override = None # None: Auto, True/False: Manual
         self.last_auto_state = None # To track transitions
         
-        # Define symbols
-        self.symbols = ["ZRB", "STAR", "SHEEP", "XIANGZI", "MIAO", "QUNZHU", "IDEAL", "FEN"]
+        # Define symbols: ordered tuple for display/iteration, frozenset for O(1) membership checks
+        self.symbols = ("ZRB", "STAR", "SHEEP", "XIANGZI", "MIAO", "QUNZHU", "IDEAL", "FEN")
+        self.symbol_set = frozenset(self.symbols)
         
         # Initial prices
         self.prices = {
@@ -87,6 +88,8 @@ class Market:
         
         self.last_update_time = time.time()
         self.update_interval = int(config.get("update_interval", 180))
+        self.last_time_sync = time.time()
+        self.time_sync_interval = 3600
         
         # News Templates
         self.news_templates = [
@@ -232,6 +235,11 @@ class Market:
     def _loop(self):
         while self.running:
             try:
+                # Periodically re-sync network time to correct clock drift
+                if time.time() - self.last_time_sync >= self.time_sync_interval:
+                    self.last_time_sync = time.time()
+                    sync_network_time()
+
                 # --- Auto Open/Close Logic ---
                 should_be_open = self._check_market_hours()
                 
@@ -314,20 +322,19 @@ class Market:
 
     def _save_candles(self):
         with self.lock:
-            session = self.db.get_session()
             now = get_china_time()
+            rows = []
             for sym in self.symbols:
                 candle = self.current_candles[sym]
-                history = MarketHistory(
-                    symbol=sym,
-                    timestamp=candle["start_time"], # Use the start time of the period
-                    open=candle["open"],
-                    high=candle["high"],
-                    low=candle["low"],
-                    close=candle["close"],
-                    volume=candle["volume"]
-                )
-                session.add(history)
+                rows.append({
+                    "symbol": sym,
+                    "timestamp": candle["start_time"], # Use the start time of the period
+                    "open": candle["open"],
+                    "high": candle["high"],
+                    "low": candle["low"],
+                    "close": candle["close"],
+                    "volume": candle["volume"]
+                })
                 
                 # Reset candle for next period
                 self.current_candles[sym] = {
@@ -338,17 +345,20 @@ class Market:
                     "volume": 0.0,
                     "start_time": now
                 }
-            session.commit()
-            session.close()
+            self.db.bulk_insert_history(rows)
 
     def match_single_order(self, order_id):
-        """Try to match a specific order immediately (for immediate feedback)"""
+        """Try to match a specific order immediately; returns its resulting OrderStatus, or None if not pending"""
         session = self.db.get_session()
         order = session.query(Order).filter_by(id=order_id, status=OrderStatus.PENDING).first()
+        status = None
         if order:
             self._process_order(session, order)
+            # Read before commit, which would expire the attribute
+            status = order.status
         session.commit()
         session.close()
+        return status
 
     def match_orders(self):
         """Match all pending orders"""
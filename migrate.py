@@ -23,6 +23,10 @@ def backup_database():
     backup_file = os.path.join(BACKUP_DIR, f"zirunbi.db.{timestamp}.bak")
     
     try:
+        # Fold any WAL content into the main file so the copy is complete
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
         shutil.copy2(DB_FILE, backup_file)
         logger.info(f"Database backed up to {backup_file}")
         return True
@@ -3,6 +3,7 @@ import os
 
 import matplotlib.pyplot as plt
 import mplfinance as mpf
+import numpy as np
 import pandas as pd
 from matplotlib import font_manager as fm
 
@@ -12,6 +13,9 @@ except ImportError:
     import logging
     logger = logging.getLogger(__name__)
 
+# Use non-interactive backend; set once here rather than on every plot
+plt.switch_backend('Agg')
+
 PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_PLUGIN_FONT = os.path.join("fonts", "SourceHanSansSC-Regular.otf")
 FALLBACK_FONT_FAMILIES = [
@@ -36,6 +40,10 @@ except Exception as e:
 # Global font prop
 _custom_font_prop = None
 
+# Custom Style: Red for Up, Green for Down (China Standard)
+KLINE_MARKET_COLORS = mpf.make_marketcolors(up='r', down='g', edge='i', wick='i', volume='in', inherit=True)
+KLINE_STYLE = mpf.make_mpf_style(marketcolors=KLINE_MARKET_COLORS, gridstyle='--', y_on_right=True)
+
 def init_font(font_path=None):
     global _custom_font_prop
 
@@ -81,35 +89,26 @@ def plot_kline(history_data, title="K-Line"):
     if not history_data:
         return None
         
-    data = []
-    for h in history_data:
-        # Ensure timestamp is formatted correctly
-        ts = h.timestamp.strftime('%Y-%m-%d %H:%M')
-        data.append({
-            'Date': ts,
-            'Open': h.open,
-            'High': h.high,
-            'Low': h.low,
-            'Close': h.close,
-            'Volume': h.volume
-        })
-    
-    df = pd.DataFrame(data)
-    # Convert 'Date' to datetime index
-    df.index = pd.DatetimeIndex(df['Date'])
+    # Build the frame column-wise with explicit float64 arrays (no dtype inference);
+    # timestamps are already datetimes from the DB
+    n = len(history_data)
+    df = pd.DataFrame(
+        {
+            'Open': np.fromiter((h.open for h in history_data), dtype=np.float64, count=n),
+            'High': np.fromiter((h.high for h in history_data), dtype=np.float64, count=n),
+            'Low': np.fromiter((h.low for h in history_data), dtype=np.float64, count=n),
+            'Close': np.fromiter((h.close for h in history_data), dtype=np.float64, count=n),
+            'Volume': np.fromiter((h.volume for h in history_data), dtype=np.float64, count=n),
+        },
+        index=pd.DatetimeIndex([h.timestamp for h in history_data], name='Date'),
+    )
     
     buf = io.BytesIO()
-    # Use non-interactive backend
-    plt.switch_backend('Agg')
-    
-    # Custom Style: Red for Up, Green for Down (China Standard)
-    mc = mpf.make_marketcolors(up='r', down='g', edge='i', wick='i', volume='in', inherit=True)
-    s = mpf.make_mpf_style(marketcolors=mc, gridstyle='--', y_on_right=True)
     
     try:
         # Use returnfig=True to allow adding text
         # datetime_format ensures X-axis is readable
-        fig, axlist = mpf.plot(df, type='candle', style=s, title=title, volume=True, 
+        fig, axlist = mpf.plot(df, type='candle', style=KLINE_STYLE, title=title, volume=True, 
                                datetime_format='%m-%d %H:%M', returnfig=True)
         
         # Add Legend/Explanation in Chinese
@@ -144,7 +143,6 @@ def plot_holdings_multi(balance, holdings_data, title="User Holdings"):
         sizes = [1]
         labels = ['Empty']
 
-    plt.switch_backend('Agg')
     fig, ax = plt.subplots()
     ax.pie(sizes, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90)
     ax.axis('equal')
@@ -1,15 +1,24 @@
 import asyncio
+import base64
+import hashlib
+import hmac
 import os
 import secrets
 import socket
+import time
+from datetime import datetime
 from typing import Optional
 
+import orjson
 import uvicorn
 from fastapi import Cookie, Depends, FastAPI, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 try:
@@ -19,10 +28,10 @@ except ImportError:
     logger = logging.getLogger(__name__)
 
 try:
-    from .database import DB, MarketHistory, Order, OrderStatus, OrderType, User, UserHolding
+    from .database import DB, AsyncDB, MarketHistory, Order, OrderStatus, OrderType, User, UserHolding
     from .market import Market
 except ImportError:
-    from database import DB, MarketHistory, Order, OrderStatus, OrderType, User, UserHolding
+    from database import DB, AsyncDB, MarketHistory, Order, OrderStatus, OrderType, User, UserHolding
     from market import Market
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -32,8 +41,37 @@ app = FastAPI()
 static_path = os.path.join(os.path.dirname(__file__), "web")
 app.mount("/static", StaticFiles(directory=static_path), name="static")
 
-# In-memory session store: token -> user_id
-_sessions: dict[str, str] = {}
+SESSION_MAX_AGE = 86400 * 7
+
+# HMAC key for session cookies; replaced by WebServer when a fixed key is configured
+_session_secret: bytes = secrets.token_bytes(32)
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(_session_secret, payload.encode(), hashlib.sha256).hexdigest()
+
+
+def create_session_token(user_id: str) -> str:
+    payload = f"{user_id}|{int(time.time()) + SESSION_MAX_AGE}"
+    encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+    return f"{encoded}.{_sign(payload)}"
+
+
+def verify_session_token(token: str) -> Optional[str]:
+    """Return the user_id of a valid, unexpired token, else None"""
+    try:
+        encoded, signature = token.rsplit(".", 1)
+        payload = base64.urlsafe_b64decode(encoded.encode()).decode()
+        user_id, expiry = payload.rsplit("|", 1)
+        expires_at = int(expiry)
+    except ValueError:
+        return None
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str input
+    if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        return None
+    if expires_at < time.time():
+        return None
+    return user_id
 
 
 def get_db():
@@ -45,10 +83,16 @@ def get_db():
         session.close()
 
 
+async def get_async_db():
+    async with app.state.async_db_instance.get_session() as session:
+        yield session
+
+
 def get_current_user(zrb_session: Optional[str] = Cookie(None)) -> str:
-    if not zrb_session or zrb_session not in _sessions:
+    user_id = verify_session_token(zrb_session) if zrb_session else None
+    if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    return _sessions[zrb_session]
+    return user_id
 
 
 class LoginModel(BaseModel):
@@ -67,29 +111,31 @@ class TradeModel(BaseModel):
 async def login(data: LoginModel, response: Response, session: Session = Depends(get_db)):
     user = session.query(User).filter_by(user_id=data.user_id).first()
     if not user or not user.password_hash:
+        # Skip the hash work but don't answer instantly
+        await asyncio.sleep(0.1)
         raise HTTPException(status_code=400, detail="User not found or password not set")
 
-    if not pwd_context.verify(data.password, user.password_hash):
+    # pbkdf2 is deliberately slow; run it off the event loop
+    verified = await run_in_threadpool(pwd_context.verify, data.password, user.password_hash)
+    if not verified:
         raise HTTPException(status_code=400, detail="Incorrect password")
 
-    token = secrets.token_urlsafe(32)
-    _sessions[token] = str(user.user_id)
+    token = create_session_token(str(user.user_id))
 
     response.set_cookie(
         key="zrb_session",
         value=token,
         httponly=True,
         samesite="strict",
-        max_age=86400 * 7,
+        max_age=SESSION_MAX_AGE,
     )
 
     return {"status": "success", "user_id": user.user_id, "balance": user.balance}
 
 
 @app.post("/api/logout")
-async def logout(response: Response, zrb_session: Optional[str] = Cookie(None)):
-    if zrb_session and zrb_session in _sessions:
-        del _sessions[zrb_session]
+async def logout(response: Response):
+    # Tokens are stateless; dropping the cookie ends the session for this browser
     response.delete_cookie("zrb_session")
     return {"status": "success"}
 
@@ -108,17 +154,22 @@ async def get_market_data():
 @app.get("/api/assets")
 async def get_assets(
     user_id: str = Depends(get_current_user),
-    session: Session = Depends(get_db),
+    session: AsyncSession = Depends(get_async_db),
 ):
-    user = session.query(User).filter_by(user_id=user_id).first()
-    if not user:
+    # One round trip: the user row joined to their non-dust holdings
+    rows = (await session.execute(
+        select(User, UserHolding)
+        .outerjoin(UserHolding, and_(UserHolding.user_id == User.user_id, UserHolding.amount > 0.0001))
+        .where(User.user_id == user_id)
+    )).all()
+    if not rows:
         raise HTTPException(status_code=404, detail="User not found")
 
-    holdings = session.query(UserHolding).filter_by(user_id=user_id).all()
+    user = rows[0][0]
     holdings_list = [
         {"symbol": h.symbol, "amount": h.amount}
-        for h in holdings
-        if h.amount > 0.0001
+        for _, h in rows
+        if h is not None
     ]
 
     return {"balance": user.balance, "holdings": holdings_list}
@@ -135,12 +186,19 @@ async def trade(
     if not market.is_open:
         raise HTTPException(status_code=400, detail="Market is closed")
 
-    user = session.query(User).filter_by(user_id=user_id).first()
-    if not user:
+    symbol = data.symbol.upper()
+
+    # Load the user and their holding of this symbol in one round trip
+    row = session.execute(
+        select(User, UserHolding)
+        .outerjoin(UserHolding, and_(UserHolding.user_id == User.user_id, UserHolding.symbol == symbol))
+        .where(User.user_id == user_id)
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
+    user, holding = row
 
-    symbol = data.symbol.upper()
-    if symbol not in market.symbols:
+    if symbol not in market.symbol_set:
         raise HTTPException(status_code=400, detail="Invalid symbol")
 
     if data.amount <= 0:
@@ -152,7 +210,6 @@ async def trade(
         if user.balance < cost:
             raise HTTPException(status_code=400, detail=f"Insufficient balance. Need {cost:.2f}")
     elif data.action == "sell":
-        holding = session.query(UserHolding).filter_by(user_id=user_id, symbol=symbol).first()
         if not holding or holding.amount < data.amount:
             raise HTTPException(status_code=400, detail="Insufficient holding")
     else:
@@ -170,13 +227,15 @@ async def trade(
     session.commit()
     order_id = order.id
 
-    market.match_single_order(order_id)
+    order_status = market.match_single_order(order_id)
+    if order_status is None:
+        # No longer pending (e.g. cancelled concurrently); the expired order reloads from the DB
+        order_status = order.status
 
-    session.refresh(order)
     return {
         "status": "success",
         "order_id": order_id,
-        "order_status": order.status.value,
+        "order_status": order_status.value,
         "message": "Order submitted",
     }
 
@@ -228,34 +287,43 @@ async def get_kline(
     symbol: str,
     since: Optional[str] = None,
     limit: int = 5000,
-    session: Session = Depends(get_db),
+    session: AsyncSession = Depends(get_async_db),
 ):
     symbol = symbol.upper()
     limit = min(max(1, limit), 5000)
 
-    query = session.query(MarketHistory).filter_by(symbol=symbol)
+    stmt = select(
+        MarketHistory.timestamp,
+        MarketHistory.open,
+        MarketHistory.high,
+        MarketHistory.low,
+        MarketHistory.close,
+        MarketHistory.volume,
+    ).filter_by(symbol=symbol)
 
     if since:
-        from datetime import datetime
+        # Accepts the ISO timestamps returned below as well as 'YYYY-MM-DD HH:MM'
         try:
-            since_dt = datetime.strptime(since, '%Y-%m-%d %H:%M')
-            query = query.filter(MarketHistory.timestamp > since_dt)
+            since_dt = datetime.fromisoformat(since)
+            stmt = stmt.where(MarketHistory.timestamp > since_dt)
         except ValueError:
             pass
 
-    history = query.order_by(MarketHistory.timestamp.asc()).limit(limit).all()
-
-    data = []
-    for h in history:
-        data.append({
-            "time": h.timestamp.strftime('%Y-%m-%d %H:%M'),
-            "open": round(h.open, 2),
-            "high": round(h.high, 2),
-            "low": round(h.low, 2),
-            "close": round(h.close, 2),
-            "volume": round(h.volume, 2),
-        })
-    return {"symbol": symbol, "data": data}
+    rows = (await session.execute(stmt.order_by(MarketHistory.timestamp.asc()).limit(limit))).all()
+
+    data = [
+        {
+            "time": ts,
+            "open": round(o, 2),
+            "high": round(hi, 2),
+            "low": round(lo, 2),
+            "close": round(c, 2),
+            "volume": round(v, 2),
+        }
+        for ts, o, hi, lo, c, v in rows
+    ]
+    # orjson encodes datetimes natively and skips FastAPI's jsonable_encoder pass over every bar
+    return Response(content=orjson.dumps({"symbol": symbol, "data": data}), media_type="application/json")
 
 
 @app.get("/")
@@ -265,13 +333,23 @@ async def index():
 
 
 class WebServer:
-    def __init__(self, db: DB, market: Market, host="0.0.0.0", port=8000):
+    def __init__(self, db: DB, market: Market, host="0.0.0.0", port=8000, secret_key=""):
+        global _session_secret
+        if secret_key:
+            # A fixed key keeps logins valid across restarts and uvicorn workers
+            _session_secret = secret_key.encode()
+
         self.config = uvicorn.Config(app, host=host, port=port, log_level="warning")
         self.server = uvicorn.Server(self.config)
         self.host = host
         self.port = port
 
+        self.serve_task = None
+        # Non-blocking reads for /api/kline and /api/assets; the market thread keeps the sync DB
+        self.async_db = AsyncDB(db.db_path)
+
         app.state.db_instance = db
+        app.state.async_db_instance = self.async_db
         app.state.market_instance = market
 
     def is_port_in_use(self) -> bool:
@@ -295,9 +373,17 @@ class WebServer:
             else:
                 logger.error(f"[Zirunbi] Web Server runtime error: {e}")
 
-    async def stop(self):
+    async def stop(self, timeout=10.0):
         self.server.should_exit = True
+        # Let in-flight requests finish before disposing the async pool they check connections out of
+        if self.serve_task is not None:
+            done, _ = await asyncio.wait({self.serve_task}, timeout=timeout)
+            if not done:
+                logger.warning("[Zirunbi] Web Server did not stop in time, cancelling.")
+                self.serve_task.cancel()
+                await asyncio.wait({self.serve_task})
+        await self.async_db.dispose()
 
     def run_in_background(self):
         loop = asyncio.get_event_loop()
-        loop.create_task(self.start())
+        self.serve_task = loop.create_task(self.start())